@@ -1,3 +1,4 @@
+import heapq
 import json
 import os
 import random
@@ -42,7 +43,7 @@ def test_lengths(
         print(t)
 
     tokenizer = AutoTokenizer.from_pretrained(name)
-    lengths = [len(tokenizer(t).input_ids) for t in tqdm(texts)]
+    lengths = tokenizer(texts, return_length=True)["length"]
     value = sorted(lengths)[round(len(texts) * percentile)]
     print(dict(value=value, percentile=percentile, min=min(lengths), max=max(lengths)))
 
@@ -52,24 +53,29 @@ def test_table_size(
     seq_len: int = 48,
     hidden_size: int = 151,
     num_labels: int = 14,
+    dtype: str = "bfloat16",
 ):
-    head = torch.rand(batch_size, seq_len, hidden_size).cuda()
-    tail = torch.rand(batch_size, seq_len, hidden_size).cuda()
-    U = torch.rand(num_labels, hidden_size, hidden_size).cuda()
-
-    triplet_score = torch.einsum("bxi, oij, byj -> bxyo", head, U, tail)
+    torch.backends.cuda.matmul.allow_tf32 = True  # Only affects float32
+    kwargs = dict(dtype=getattr(torch, dtype), device="cuda")
+    head = torch.rand(batch_size, seq_len, hidden_size, **kwargs)
+    tail = torch.rand(batch_size, seq_len, hidden_size, **kwargs)
+    U = torch.rand(num_labels, hidden_size, hidden_size, **kwargs)
+
+    # Contract pairwise so each step is a single batched matmul
+    head_u = torch.einsum("bxi, oij -> bxoj", head, U)
+    triplet_score = torch.einsum("bxoj, byj -> bxyo", head_u, tail)
     print(dict(triplet_score=triplet_score.shape))  # (batch, len, len, labels)
 
-    value = torch.rand(batch_size, seq_len, hidden_size).cuda()
-    V = torch.zeros(num_labels, hidden_size * 2, hidden_size).cuda()
-    pair = torch.cat(
-        [
-            head.unsqueeze(dim=2).expand(-1, -1, seq_len, -1),
-            tail.unsqueeze(dim=1).expand(-1, seq_len, -1, -1),
-        ],
-        dim=-1,
-    )
-    final_score = torch.einsum("bxyi, oij, bzj -> bxyzo", pair, V, value)
+    value = torch.rand(batch_size, seq_len, hidden_size, **kwargs)
+    V = torch.zeros(num_labels, hidden_size * 2, hidden_size, **kwargs)
+    # pair = [head_x; tail_y] so pair V = head_x V_h + tail_y V_t
+    # Score each half separately and broadcast instead of building pair
+    V_h, V_t = V[:, :hidden_size, :], V[:, hidden_size:, :]
+    value_h = torch.einsum("oij, bzj -> bzoi", V_h, value)
+    value_t = torch.einsum("oij, bzj -> bzoi", V_t, value)
+    head_score = torch.einsum("bxi, bzoi -> bxzo", head, value_h)
+    tail_score = torch.einsum("byi, bzoi -> byzo", tail, value_t)
+    final_score = head_score.unsqueeze(dim=2) + tail_score.unsqueeze(dim=1)
     print(dict(final_score=final_score.shape))
 
 
@@ -113,7 +119,7 @@ def test_nyt(
 
 def test_data(path: str = "data/ACE2005/test.json"):
     with open(path) as f:
-        sents = [Sentence(**json.loads(line)) for line in f]
+        sents = [Sentence.parse_raw(line) for line in f]
     print(dict(sents=len(sents)))
 
     for s in sents:
@@ -127,8 +133,8 @@ def test_data(path: str = "data/ACE2005/test.json"):
 
 
 def test_quintuplet_sents(path: str = "data/quintuplet/dev.json"):
-    with open(path) as f:
-        sents = [Sentence(**json.loads(line)) for line in tqdm(f)]
+    with open(path, "rb") as f:
+        sents = [Sentence.parse_raw(line) for line in tqdm(f)]
 
     print("\nHow many entities per sentence?")
     lengths = [len(s.entities) for s in sents]
@@ -137,21 +143,18 @@ def test_quintuplet_sents(path: str = "data/quintuplet/dev.json"):
     print("\nWhat fraction of the cubes (quintuplets) are empty?")
     total = 0
     filled = 0
-    sizes = []
-    counts = []
     for s in sents:
         assert s.quintupletMatrix is not None
         total += s.quintupletMatrix.numel()
-        sizes.append(s.quintupletMatrix.numel())
         filled += len(s.quintupletMatrix.entries)
-        counts.append(len(s.quintupletMatrix.entries))
-    print(dict(frac=1 - (filled / total), sizes=np.mean(sizes), counts=np.mean(counts)))
+    sizes, counts = total / len(sents), filled / len(sents)
+    print(dict(frac=1 - (filled / total), sizes=sizes, counts=counts))
 
     print("\nWhat fraction of the tables (relations) are empty?")
+    tables = [np.array(s.jointLabelMatrix) for s in sents]
     total = 0
     filled = 0
-    for s in sents:
-        table = np.array(s.jointLabelMatrix)
+    for table in tables:
         total += table.size
         filled += np.sum(table > 0)
     print(1 - (filled / total))
@@ -160,11 +163,11 @@ def test_quintuplet_sents(path: str = "data/quintuplet/dev.json"):
     total = 0
     filled = 0
     lengths = []
-    for s in sents:
-        row = list(np.diagonal(np.array(s.jointLabelMatrix)))
+    for table in tables:
+        row = np.diagonal(table)
         total += len(row)
-        filled += sum(row)
-        lengths.append(sum(row))
+        filled += row.sum()
+        lengths.append(row.sum())
     print(dict(min=min(lengths), avg=np.mean(lengths), max=max(lengths)))
     print(1 - (filled / total))
 
@@ -178,13 +181,12 @@ def test_quintuplet_sents(path: str = "data/quintuplet/dev.json"):
 
     print("\nWhat is the average number of entity tokens in a sentence?")
     lengths = []
-    for s in sents:
-        tags = [0 for _ in s.text.split()]
+    for s, table in zip(sents, tables):
+        tags = np.zeros(len(s.text.split()), dtype=int)
         for e in s.entities:
-            for i in range(e.span[0], e.span[1]):
-                tags[i] = 1
-        lengths.append(sum(tags))
-        assert list(np.diagonal(np.array(s.jointLabelMatrix))) == tags
+            tags[e.span[0] : e.span[1]] = 1
+        lengths.append(tags.sum())
+        assert np.array_equal(np.diagonal(table), tags)
     print(sum(lengths) / len(lengths))
 
     print("\nWhat is average entity length?")
@@ -205,15 +207,12 @@ def test_quintuplet_sents(path: str = "data/quintuplet/dev.json"):
     counts = []
     for s in sents:
         seq_len = len(s.text.split())
-        cube = np.zeros(shape=(seq_len, seq_len, seq_len))
+        cube = np.zeros(shape=(seq_len, seq_len, seq_len), dtype=bool)
         for r in s.relations:
             for q in r.qualifiers:
                 head, tail, value = r.head, r.tail, q.span
-                assert len({head, tail, value}) == 3
-                for i in range(*head):
-                    for j in range(*tail):
-                        for k in range(*value):
-                            cube[i, j, k] = 1
+                assert head != tail and head != value and tail != value
+                cube[slice(*head), slice(*tail), slice(*value)] = True
         sizes.append(cube.size)
         counts.append(cube.sum())
     print(
@@ -226,32 +225,24 @@ def test_quintuplet_sents(path: str = "data/quintuplet/dev.json"):
     selected = []
     seen = set()
     for s in sents:
-        tags = [0 for _ in s.text.split()]
-        for e in s.entities:
-            for i in range(e.span[0], e.span[1]):
-                if tags[i] == 1 and s.text not in seen:
-                    seen.add(s.text)
-                    selected.append(s)
-                else:
-                    tags[i] = 1
+        if s.check_span_overlap():
+            if s.text not in seen:
+                seen.add(s.text)
+                selected.append(s)
     print(dict(frac=len(selected) / len(sents)))
 
     print("\nIf restrict to top-50 qualifiers, how many quintuplets are affected?")
     top_k = 50
-    qualifiers = []
-    for s in sents:
-        for q in [q for r in s.relations for q in r.qualifiers]:
-            qualifiers.append(q.label)
-    counter = Counter(qualifiers)
-    threshold = sorted(counter.values())[-top_k]
+    counter = Counter(q.label for s in sents for r in s.relations for q in r.qualifiers)
+    threshold = heapq.nlargest(top_k, counter.values())[-1]
     remainder = sum(v for v in counter.values() if v >= threshold)
-    print(dict(threshold=threshold, remainder=remainder, total=len(qualifiers)))
+    print(dict(threshold=threshold, remainder=remainder, total=sum(counter.values())))
 
 
 def test_sparse_cube(path: str = "data/q10/dev.json"):
     with open(path) as f:
-        for line in tqdm(f.readlines()):
-            sent = Sentence(**json.loads(line))
+        for line in tqdm(f):
+            sent = Sentence.parse_raw(line)
             matrix = sent.quintupletMatrix
             x = matrix.numpy()
             new = SparseCube.from_numpy(x)
@@ -291,9 +282,9 @@ def compare_tag_data(
     path_tag: str = "data/q10_tagger/dev.json", path_orig="data/q10/dev.json"
 ):
     with open(path_orig) as f:
-        sents_orig = [Sentence(**json.loads(line)) for line in f]
+        sents_orig = [Sentence.parse_raw(line) for line in f]
     with open(path_tag) as f:
-        sents_tag = [Sentence(**json.loads(line)) for line in f]
+        sents_tag = [Sentence.parse_raw(line) for line in f]
 
     print("\nOrig stats?")
     print(json.dumps(analyze_sents(sents_orig)))
@@ -314,15 +305,20 @@ def compare_tag_data(
 
 def test_decode_nonzero_cuboids(path: str = "data/q10/dev.json"):
     with open(path) as f:
-        sents = [Sentence(**json.loads(line)) for line in tqdm(f.readlines())]
-
-    cubes = [torch.tensor(s.quintupletMatrix.numpy()) for s in tqdm(sents)]
-    for i, c in enumerate(tqdm(cubes, desc="nonzero")):
-        assert c.nonzero().shape[0] > 0
+        sents = [Sentence.parse_raw(line) for line in tqdm(f)]
+
+    for s in tqdm(sents, desc="nonzero"):
+        coords, values = s.quintupletMatrix.as_arrays()
+        assert len(values) > 0
+        c = torch.sparse_coo_tensor(
+            torch.from_numpy(coords.T).long(),
+            torch.from_numpy(values),
+            s.quintupletMatrix.shape,
+        )
         cuboids = decode_nonzero_cuboids(c)
-        num_qualifiers = sum(len(r.qualifiers) for r in sents[i].relations)
+        num_qualifiers = sum(len(r.qualifiers) for r in s.relations)
         if num_qualifiers != len(cuboids):
-            pprint(sents[i])
+            pprint(s)
             pprint(cuboids)
             print()
 
@@ -354,9 +350,9 @@ def compare_sents(
     path_a: str = "data/q10/dev.json", path_b: str = "data/q10_copy/dev.json"
 ):
     with open(path_a) as f:
-        sents_a = [Sentence(**json.loads(line)) for line in f]
+        sents_a = [Sentence.parse_raw(line) for line in f]
     with open(path_b) as f:
-        sents_b = [Sentence(**json.loads(line)) for line in f]
+        sents_b = [Sentence.parse_raw(line) for line in f]
 
     assert len(sents_a) == len(sents_b)
     for a, b in zip(sents_a, sents_b):
@@ -435,13 +431,13 @@ def find_best(pattern: str = "ckpt/*prune*/train.log"):
     for path in sorted(Path().glob(pattern)):
         print(path)
         with open(path) as f:
-            lines = [x for x in f.readlines() if "best_score" in x]
+            lines = [x for x in f if "best_score" in x]
             print(lines[-1])
 
 
 def test_adjacent_qualifiers(path: str = "data/q10/test.json"):
     with open(path) as f:
-        sents = [Sentence(**json.loads(line)) for line in f]
+        sents = [Sentence.parse_raw(line) for line in f]
 
     total = 0
     selected = 0
@@ -759,7 +755,8 @@ def test_unique_facts(folder: str = "data/q10"):
 
 
 def sent_to_tuples(s: Sentence) -> Set[Tuple[str, str, str, str, str]]:
-    return set(tup for r in s.relations for tup in r.as_tuples(s.tokens))
+    cache = {}
+    return set(tup for r in s.relations for tup in r.as_tuples(s.tokens, cache))
 
 
 def test_cases(
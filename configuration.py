@@ -447,6 +447,12 @@ class ConfigurationParer:
             default=-1,
             help="cpu: device = -1, gpu: gpu device id(device >= 0).",
         )
+        group.add(
+            "-amp",
+            "--amp",
+            action="store_true",
+            help="compute quintuplet scores in bfloat16 autocast on gpu.",
+        )
 
         # logging configurations
         group = self.parser.add_argument_group("logging")
@@ -1,12 +1,18 @@
 import hashlib
 import json
+import multiprocessing
 import pickle
 import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 
 import fire
 import numpy as np
+import orjson
 from datasets import load_dataset
 from pydantic import BaseModel
 from pydantic.main import Extra
@@ -16,6 +22,11 @@ from transformers.models.auto.tokenization_auto import AutoTokenizer
 Span = Tuple[int, int]
 
 
+def orjson_dumps(v, *, default) -> str:
+    # Pydantic expects json_dumps to return str, orjson returns bytes
+    return orjson.dumps(v, default=default).decode()
+
+
 class FlatQuintuplet(BaseModel):
     tokens: List[str]
     head: Span
@@ -25,12 +36,15 @@ class FlatQuintuplet(BaseModel):
     qualifier: str
 
 
-def load_quintuplets(path: str) -> List[FlatQuintuplet]:
-    with open(path) as f:
-        return [FlatQuintuplet(**json.loads(line)) for line in f]
+def load_quintuplets(path: str, trusted: bool = False) -> List[FlatQuintuplet]:
+    with open(path, "rb") as f:
+        if trusted:
+            # Skip validation for files we wrote ourselves, spans stay as lists
+            return [FlatQuintuplet.construct(**orjson.loads(line)) for line in f]
+        return [FlatQuintuplet(**orjson.loads(line)) for line in f]
 
 
-class Entity(BaseModel):
+class Entity(BaseModel, frozen=True):
     span: Span  # Token spans, start inclusive, end exclusive
     label: str
 
@@ -51,18 +65,25 @@ class Relation(BaseModel):
             other.tail,
             other.label,
         )
-        qualifiers: Dict[str, Entity] = {q.json(): q for q in self.qualifiers}
+        qualifiers: Dict[Entity, Entity] = {q: q for q in self.qualifiers}
         for q in other.qualifiers:
-            qualifiers[q.json()] = q
+            qualifiers[q] = q
         self.qualifiers = list(qualifiers.values())
 
-    def as_tuples(self, tokens: List[str]) -> List[Tuple[str, str, str, str, str]]:
+    def as_tuples(
+        self, tokens: List[str], cache: Optional[Dict[Span, str]] = None
+    ) -> List[Tuple[str, str, str, str, str]]:
+        # Span texts can be cached across the relations of the same sentence
+        if cache is None:
+            cache = {}
+        for span in [self.head, self.tail] + [q.span for q in self.qualifiers]:
+            if span not in cache:
+                cache[span] = " ".join(tokens[slice(*span)])
+
         tuples = []
-        head = " ".join(tokens[slice(*self.head)])
-        tail = " ".join(tokens[slice(*self.tail)])
+        head, tail = cache[self.head], cache[self.tail]
         for q in self.qualifiers:
-            value = " ".join(tokens[slice(*q.span)])
-            tuples.append((head, self.label, tail, q.label, value))
+            tuples.append((head, self.label, tail, q.label, cache[q.span]))
         return tuples
 
 
@@ -76,21 +97,27 @@ class SparseCube(BaseModel):
 
     @classmethod
     def from_numpy(cls, x: np.ndarray):
-        entries = []
-        i_list, j_list, k_list = x.nonzero()
-        for i, j, k in zip(i_list, j_list, k_list):
-            entries.append((i, j, k, x[i, j, k]))
-        return cls(shape=tuple(x.shape), entries=entries)
+        coords = np.stack(x.nonzero(), axis=1)
+        entries = np.concatenate([coords, x[tuple(coords.T)][:, None]], axis=1)
+        return cls(shape=tuple(x.shape), entries=entries.tolist())
+
+    def as_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Coordinates (N, 3) and values (N,) of the entries, without densifying
+        array = np.asarray(self.entries, dtype=np.int32).reshape(-1, 4)
+        return array[:, :3], array[:, 3]
 
     def numpy(self) -> np.ndarray:
-        x = np.zeros(shape=self.shape)
-        for i, j, k, value in self.entries:
-            x[i, j, k] = value
+        x = np.zeros(shape=self.shape, dtype=np.int64)
+        coords, values = self.as_arrays()
+        x[coords[:, 0], coords[:, 1], coords[:, 2]] = values
         return x
 
     def tolist(self) -> List[List[List[int]]]:
-        x = self.numpy()
-        return [[list(row) for row in table] for table in x]
+        i, j, k = self.shape
+        x = [[[0] * k for _ in range(j)] for _ in range(i)]
+        for a, b, c, value in self.entries:
+            x[a][b][c] = value
+        return x
 
     def numel(self) -> int:
         i, j, k = self.shape
@@ -101,7 +128,7 @@ class SparseCube(BaseModel):
         return cls(shape=(0, 0, 0), entries=[])
 
 
-class Sentence(BaseModel):
+class Sentence(BaseModel, json_loads=orjson.loads, json_dumps=orjson_dumps):
     tokens: List[str]
     entities: List[Entity]
     relations: List[Relation]
@@ -112,13 +139,12 @@ class Sentence(BaseModel):
     quintupletMatrix: Optional[SparseCube]
 
     def check_span_overlap(self) -> bool:
-        entity_pos = [0 for _ in range(9999)]
-        for e in self.entities:
-            st, ed = e.span
-            for i in range(st, ed):
-                if entity_pos[i] != 0:
-                    return True
-                entity_pos[i] = 1
+        # Sweep spans by start: overlap if a span starts before an earlier one ends
+        max_end = 0
+        for st, ed in sorted(e.span for e in self.entities if e.span[0] < e.span[1]):
+            if st < max_end:
+                return True
+            max_end = max(max_end, ed)
         return False
 
     @property
@@ -132,9 +158,9 @@ class Sentence(BaseModel):
         assert isinstance(other, Sentence)
         assert other.text == self.text
 
-        ents = {e.json(): e for e in self.entities}
+        ents = {e: e for e in self.entities}
         for e in other.entities:
-            ents[e.json()] = e
+            ents[e] = e
         self.entities = list(ents.values())
 
         relations = {(r.head, r.tail, r.label): r for r in self.relations}
@@ -154,26 +180,25 @@ class Data(BaseModel):
 
     @classmethod
     def load(cls, path: str):
-        with open(path) as f:
-            lines = f.readlines()
-
-        sents = [Sentence(**json.loads(line)) for line in tqdm(lines, desc=path)]
+        with open(path, "rb") as f:
+            sents = [Sentence.parse_raw(line) for line in tqdm(f, desc=path)]
         return cls(sents=sents)
 
     def save(self, path: str):
         Path(path).parent.mkdir(exist_ok=True, parents=True)
-        with open(path, "w") as f:
+        with open(path, "wb", buffering=1 << 20) as f:
             for s in self.sents:
                 raw = s.dict()
                 raw = {k: v for k, v in raw.items() if v is not None}
-                f.write(json.dumps(raw) + "\n")
+                f.write(orjson.dumps(raw) + b"\n")
 
     def to_flat_quintuplets(self) -> List[FlatQuintuplet]:
         outputs = []
         for s in tqdm(self.sents, desc="to_flat_quintuplets"):
             for r in s.relations:
                 for q in r.qualifiers:
-                    flat = FlatQuintuplet(
+                    # Fields come from validated models, so skip re-validating
+                    flat = FlatQuintuplet.construct(
                         tokens=s.tokens,
                         head=r.head,
                         tail=r.tail,
@@ -185,26 +210,47 @@ class Data(BaseModel):
         return outputs
 
     @classmethod
-    def load_from_flat_quintuplets(cls, path: str):
-        quintuplets = load_quintuplets(path)
-        mapping: Dict[str, Sentence] = {}
-
-        for q in tqdm(quintuplets, desc="load_from_flat_quintuplets"):
-            ents = [
-                Entity(span=span, label="Entity") for span in [q.head, q.tail, q.value]
-            ]
-            relation = Relation(
-                head=q.head,
-                tail=q.tail,
-                label=q.relation,
-                qualifiers=[Entity(span=q.value, label=q.qualifier)],
+    def load_from_flat_quintuplets(cls, path: str, trusted: bool = False):
+        quintuplets = load_quintuplets(path, trusted=trusted)
+        groups: Dict[Tuple[str, ...], List[FlatQuintuplet]] = defaultdict(list)
+        for q in quintuplets:
+            groups[tuple(q.tokens)].append(q)
+
+        sents = []
+        for group in tqdm(groups.values(), desc="load_from_flat_quintuplets"):
+            # Same result as Sentence.merge per quintuplet, which moves the newest
+            # entities, relations and qualifiers to the front, but on plain keys
+            ents: Dict[Span, None] = {}
+            relations: Dict[Tuple[Span, Span, str], Dict[Tuple[Span, str], None]] = {}
+            for q in reversed(group):
+                head, tail, value = tuple(q.head), tuple(q.tail), tuple(q.value)
+                for span in [head, tail, value]:
+                    ents.setdefault(span, None)
+                qualifiers = relations.setdefault((head, tail, q.relation), {})
+                qualifiers.setdefault((value, q.qualifier), None)
+
+            spans = list(ents)
+            if len(group) == 1:
+                # Nothing merged, so no deduplication
+                q = group[0]
+                spans = [tuple(q.head), tuple(q.tail), tuple(q.value)]
+
+            sent = Sentence(
+                tokens=group[-1].tokens,
+                entities=[dict(span=span, label="Entity") for span in spans],
+                relations=[
+                    dict(
+                        head=r_head,
+                        tail=r_tail,
+                        label=r_label,
+                        qualifiers=[dict(span=v, label=k) for v, k in r_qualifiers],
+                    )
+                    for (r_head, r_tail, r_label), r_qualifiers in relations.items()
+                ],
             )
-            sent = Sentence(tokens=q.tokens, entities=ents, relations=[relation])
-            sent.merge(mapping.get(sent.text))
-            assert sent is not None
-            mapping[sent.text] = sent
+            sents.append(sent)
 
-        data = cls(sents=list(mapping.values()))
+        data = cls(sents=sents)
         old = set(flat.json() for flat in quintuplets)
         new = set(flat.json() for flat in data.to_flat_quintuplets())
         assert old == new
@@ -289,7 +335,20 @@ class RawPred(BaseModel, extra=Extra.forbid, arbitrary_types_allowed=True):
         )
 
 
-def add_tokens(sent, tokenizer):
+def update_wordpiece_cache(tokens: List[str], tokenizer, cache: Dict[str, List[str]]):
+    # Encode all unseen words in one batched call instead of tokenize() per word
+    missing = list(dict.fromkeys(t for t in tokens if t not in cache))
+    if not missing:
+        return
+    words = missing
+    if "roberta" in type(tokenizer).__name__.lower():
+        words = [" " + token for token in missing]  # RoBERTa is space-sensitive
+    encoded = tokenizer(words, add_special_tokens=False)["input_ids"]
+    for token, ids in zip(missing, encoded):
+        cache[token] = tokenizer.convert_ids_to_tokens(ids)
+
+
+def add_tokens(sent, tokenizer, cache: Optional[Dict[str, List[str]]] = None):
     cls = tokenizer.cls_token
     sep = tokenizer.sep_token
     wordpiece_tokens = [cls, sep]
@@ -300,12 +359,14 @@ def add_tokens(sent, tokenizer):
     context_len = len(wordpiece_tokens)
     wordpiece_segment_ids = [0] * context_len
 
+    if cache is None:
+        cache = {}
+    update_wordpiece_cache(sent["tokens"], tokenizer, cache)
+
     wordpiece_tokens_index = []
     cur_index = len(wordpiece_tokens)
     for token in sent["tokens"]:
-        if is_roberta:
-            token = " " + token  # RoBERTa is space-sensitive
-        tokenized_token = list(tokenizer.tokenize(token))
+        tokenized_token = cache[token]
         wordpiece_tokens.extend(tokenized_token)
         wordpiece_tokens_index.append([cur_index, cur_index + len(tokenized_token)])
         cur_index += len(tokenized_token)
@@ -322,32 +383,58 @@ def add_tokens(sent, tokenizer):
     return sent
 
 
-def add_joint_label(sent, label_vocab):
+def add_joint_label(sent, label_vocab, scratch: Optional[np.ndarray] = None):
     """add_joint_label add joint labels for sentences"""
 
     ent_rel_id = label_vocab["id"]
     none_id = ent_rel_id["None"]
     seq_len = len(sent["tokens"])
-    label_matrix = [[none_id for _ in range(seq_len)] for _ in range(seq_len)]
+    if scratch is not None and scratch.shape[0] >= seq_len:
+        # Fill a view of the caller's buffer instead of allocating per sentence
+        label_matrix = scratch[:seq_len, :seq_len]
+        label_matrix.fill(none_id)
+    else:
+        label_matrix = np.full((seq_len, seq_len), none_id, dtype=np.int32)
 
     for ent in sent["entities"]:
-        for i in range(ent["span"][0], ent["span"][1]):
-            for j in range(ent["span"][0], ent["span"][1]):
-                label_matrix[i][j] = ent_rel_id[ent["label"]]
+        start, end = ent["span"]
+        label_matrix[start:end, start:end] = ent_rel_id[ent["label"]]
 
-    entries: List[Tuple[int, int, int, int]] = []
+    blocks = []
     for rel in sent["relations"]:
-        for i in range(rel["head"][0], rel["head"][1]):
-            for j in range(rel["tail"][0], rel["tail"][1]):
-                label_matrix[i][j] = ent_rel_id[rel["label"]]
-                for q in rel["qualifiers"]:
-                    for k in range(q["span"][0], q["span"][1]):
-                        entries.append((i, j, k, ent_rel_id[q["label"]]))
-
-    sent["jointLabelMatrix"] = label_matrix
-    sent["quintupletMatrix"] = SparseCube(
-        shape=(seq_len, seq_len, seq_len), entries=entries
-    ).dict()
+        h0, h1 = rel["head"]
+        t0, t1 = rel["tail"]
+        label_matrix[h0:h1, t0:t1] = ent_rel_id[rel["label"]]
+        qualifiers = rel["qualifiers"]
+        if not qualifiers:
+            continue
+
+        # Entries are ordered by (i, j), then qualifier, then k as before
+        spans = [q["span"] for q in qualifiers]
+        k = np.concatenate([np.arange(start, end) for start, end in spans])
+        values = np.repeat(
+            [ent_rel_id[q["label"]] for q in qualifiers],
+            [end - start for start, end in spans],
+        )
+        blocks.append(((h1 - h0, t1 - t0, len(k)), h0, t0, k, values))
+
+    # Broadcast each head x tail x value block into one preallocated buffer
+    sizes = [int(np.prod(shape)) for shape, *_ in blocks]
+    entries = np.empty((sum(sizes), 4), dtype=np.int64)
+    offset = 0
+    for size, (shape, h0, t0, k, values) in zip(sizes, blocks):
+        block = entries[offset : offset + size].reshape(*shape, 4)
+        block[..., 0] = np.arange(h0, h0 + shape[0])[:, None, None]
+        block[..., 1] = np.arange(t0, t0 + shape[1])[None, :, None]
+        block[..., 2] = k
+        block[..., 3] = values
+        offset += size
+
+    sent["jointLabelMatrix"] = label_matrix.tolist()
+    # Same fields as SparseCube.dict(), without validating and copying entries
+    sent["quintupletMatrix"] = dict(
+        shape=(seq_len, seq_len, seq_len), entries=entries.tolist()
+    )
     return sent
 
 
@@ -372,12 +459,51 @@ def add_tag_joint_label(sent, label_vocab):
     return sent
 
 
+def tokenize_many(lines, tokenizer, cache: dict, batch_size: int = 1024):
+    # Warm the cache for a whole batch of sentences with one tokenizer call
+    lines = iter(lines)
+    for batch in iter(lambda: list(islice(lines, batch_size)), []):
+        sents = [orjson.loads(line) for line in batch]
+        update_wordpiece_cache(
+            [t for s in sents for t in s["tokens"]], tokenizer, cache
+        )
+        for sent in sents:
+            yield add_tokens(sent, tokenizer, cache)
+
+
+def prefetch(chunks):
+    # Produce the next chunk in a background thread while this one is consumed
+    with ThreadPoolExecutor(1) as pool:
+        future = pool.submit(next, chunks, None)
+        while True:
+            chunk = future.result()
+            if chunk is None:
+                break
+            future = pool.submit(next, chunks, None)
+            yield chunk
+
+
+_label_scratch = np.empty((512, 512), dtype=np.int32)
+
+
+def dump_joint_label(sent, label_vocab: dict) -> bytes:
+    # Top-level so that it can be pickled for worker processes
+    global _label_scratch
+    seq_len = len(sent["tokens"])
+    if seq_len > _label_scratch.shape[0]:
+        # Grow the per-process buffer only when a longer sentence appears
+        _label_scratch = np.empty((seq_len, seq_len), dtype=np.int32)
+    sent = add_joint_label(sent, label_vocab, scratch=_label_scratch)
+    return orjson.dumps(sent, option=orjson.OPT_APPEND_NEWLINE)
+
+
 def process(
     source_file: str,
     target_file: str,
     label_file: str = "data/quintuplet/label_vocab.json",
     pretrained_model: str = "bert-base-uncased",
     mode: str = "",
+    num_workers: int = 1,
 ):
     print(dict(process=locals()))
     auto_tokenizer = AutoTokenizer.from_pretrained(pretrained_model)
@@ -386,36 +512,57 @@ def process(
     with open(label_file) as f:
         label_vocab = json.load(f)
 
-    with open(source_file) as fin, open(target_file, "w") as fout:
-        for line in tqdm(fin.readlines()):
-            if mode == "tags":
-                s = Sentence(**json.loads(line))
+    cache = {}  # Word to wordpieces, shared by all sentences
+    with open(source_file, "rb") as fin, open(
+        target_file, "wb", buffering=1 << 20
+    ) as fout:
+        if mode == "tags":
+            for line in tqdm(fin):
+                s = Sentence.parse_raw(line)
                 for s in convert_sent_to_tags(s):
                     sent = s.dict()
-                    sent = add_tokens(sent, auto_tokenizer)
+                    sent = add_tokens(sent, auto_tokenizer, cache)
                     sent = add_tag_joint_label(sent, label_vocab)
-                    print(json.dumps(sent), file=fout)
+                    fout.write(orjson.dumps(sent, option=orjson.OPT_APPEND_NEWLINE))
+        elif mode == "joint":
+            # Tokenize in the main process, label and serialize in workers
+            sents = tokenize_many(tqdm(fin), auto_tokenizer, cache)
+            fn = partial(dump_joint_label, label_vocab=label_vocab)
+            # Submit in bounded chunks as map() consumes its whole input
+            chunks = prefetch(iter(lambda: list(islice(sents, 256 * 16)), []))
+            if num_workers > 1:
+                # Spawn rather than fork: the prefetch thread may hold tokenizer or
+                # logging locks when workers start, which forked children inherit
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(num_workers, mp_context=context) as pool:
+                    # Keep one chunk in flight so workers label it during the next
+                    pending = []
+                    for chunk in chunks:
+                        results = pool.map(fn, chunk, chunksize=256)
+                        fout.write(b"".join(pending))
+                        pending = results
+                    fout.write(b"".join(pending))
             else:
-                sent = json.loads(line.strip())
-                sent = add_tokens(sent, auto_tokenizer)
-                if mode == "joint":
-                    sent = add_joint_label(sent, label_vocab)
-                else:
-                    raise ValueError
-                print(json.dumps(sent), file=fout)
+                for chunk in chunks:
+                    fout.write(b"".join(map(fn, chunk)))
+        else:
+            raise ValueError
 
 
 def make_label_file(pattern_in: str, path_out: str):
-    sents = []
+    relation_set = set()
+    qualifier_set = set()
     for path in sorted(Path().glob(pattern_in)):
-        with open(path) as f:
-            sents.extend([Sentence(**json.loads(line)) for line in tqdm(f)])
-
-    relations = sorted(set(r.label for s in sents for r in s.relations))
-    qualifiers = sorted(
-        set(q.label for s in sents for r in s.relations for q in r.qualifiers)
-    )
-    labels = ["None", "Entity"] + qualifiers + sorted(set(relations) - set(qualifiers))
+        with open(path, "rb") as f:
+            for line in tqdm(f):
+                # Only the labels are needed, so skip building Sentence models
+                for r in orjson.loads(line)["relations"]:
+                    relation_set.add(r["label"])
+                    qualifier_set.update(q["label"] for q in r["qualifiers"])
+
+    relations = sorted(relation_set)
+    qualifiers = sorted(qualifier_set)
+    labels = ["None", "Entity"] + qualifiers + sorted(relation_set - qualifier_set)
     label_map = {name: i for i, name in enumerate(labels)}
     print(dict(relations=len(relations), qualifiers=len(qualifiers)))
 
@@ -434,19 +581,16 @@ def make_label_file(pattern_in: str, path_out: str):
 
 
 def make_tag_label_file(pattern_in: str, path_out: str):
-    tags = []
-    qualifiers = []
+    qualifier_set = set()
     for path in sorted(Path().glob(pattern_in)):
-        with open(path) as f:
+        with open(path, "rb") as f:
             for line in tqdm(f):
-                s = Sentence(**json.loads(line))
-                for q in [q for r in s.relations for q in r.qualifiers]:
-                    tags.append("B-" + q.label)
-                    tags.append("I-" + q.label)
-                    qualifiers.append(q.label)  # Dataset reader needs it
-
-    tags = sorted(set(tags))
-    qualifiers = sorted(set(qualifiers))
+                # Only the labels are needed, so skip building Sentence models
+                for r in orjson.loads(line)["relations"]:
+                    qualifier_set.update(q["label"] for q in r["qualifiers"])
+
+    tags = sorted(prefix + label for label in qualifier_set for prefix in ("B-", "I-"))
+    qualifiers = sorted(qualifier_set)  # Dataset reader needs it
     labels = ["O"] + tags + qualifiers
     info = dict(
         id={name: i for i, name in enumerate(labels)},
@@ -460,16 +604,17 @@ def make_tag_label_file(pattern_in: str, path_out: str):
 
 def convert_sent_to_tags(sent: Sentence) -> List[Sentence]:
     outputs = []
+    sent_text = sent.text  # Joined once rather than per relation
     for r in sent.relations:
         head = " ".join(sent.tokens[slice(*r.head)])
         tail = " ".join(sent.tokens[slice(*r.tail)])
-        parts = [sent.text, head, r.label, tail]
+        parts = [sent_text, head, r.label, tail]
         text = " | ".join(parts)
 
-        new = sent.copy(deep=True)
-        new.tokens = text.split()
-        new.entities = r.qualifiers
-        new.relations = []
+        # Shallow copy, the other fields are only read by callers
+        new = sent.copy(
+            update=dict(tokens=text.split(), entities=r.qualifiers, relations=[])
+        )
         outputs.append(new)
 
     return outputs
@@ -487,61 +632,73 @@ def load_raw_preds(path: str) -> List[RawPred]:
     return raw_preds
 
 
+def copy_data(path_in: str, path_out: str):
+    data = Data.load(path_in)
+    data.analyze()
+    data.save(path_out)
+
+
+def map_files(fn, paths_in: List[str], paths_out: List[str], num_workers: int = 1):
+    # Files are independent, so fn can run in worker processes
+    if num_workers > 1:
+        with ProcessPoolExecutor(num_workers) as pool:
+            list(pool.map(fn, paths_in, paths_out))
+    else:
+        list(map(fn, paths_in, paths_out))
+
+
 def process_many(
     dir_in: str,
     dir_out: str,
     dir_temp: str = "temp",
     mode: str = "joint",
+    num_file_workers: int = 1,
     **kwargs,
 ):
     if Path(dir_temp).exists():
         shutil.rmtree(dir_temp)
-    for path in sorted(Path(dir_in).glob("*.json")):
-        data = Data.load(str(path))
-        data.analyze()
-        data.save(str(Path(dir_temp) / path.name))
+    paths = sorted(Path(dir_in).glob("*.json"))
+    paths_temp = [str(Path(dir_temp) / p.name) for p in paths]
+    map_files(copy_data, [str(p) for p in paths], paths_temp, num_file_workers)
 
     path_label = str(Path(dir_out) / "label.json")
     if mode == "tags":
         make_tag_label_file(f"{dir_temp}/*.json", path_label)
     else:
         make_label_file(f"{dir_temp}/*.json", path_label)
-    for path in sorted(Path(dir_temp).glob("*.json")):
-        process(
-            str(path), str(Path(dir_out) / path.name), path_label, mode=mode, **kwargs
-        )
+
+    # Each worker loads its own tokenizer
+    fn = partial(process, label_file=path_label, mode=mode, **kwargs)
+    paths_out = [str(Path(dir_out) / p.name) for p in paths]
+    map_files(fn, paths_temp, paths_out, num_file_workers)
     shutil.rmtree(dir_temp)
 
 
 class BioEncoder:
     def run(self, spans: List[Tuple[int, int, str]], length: int) -> List[str]:
         assert self is not None
-        tags = ["O" for _ in range(length)]
+        tags = ["O"] * length
         for start, end, label in spans:
             assert start < end
             assert end <= length
-            for i in range(start, end):
-                tags[i] = "I-" + label
+            tags[start:end] = ["I-" + label] * (end - start)
             tags[start] = "B-" + label
         return tags
 
     def decode(self, tags: List[str]) -> List[Tuple[int, int, str]]:
         assert self is not None
-        parts = []
+        parts = []  # [start, end] of each span, indices only ever increase
         for i, t in enumerate(tags):
             assert t[0] in "BIO"
-            if t.startswith("B"):
-                parts.append([i])
-            if parts and t.startswith("I"):
-                parts[-1].append(i)
+            if t[0] == "B":
+                parts.append([i, i + 1])
+            elif parts and t[0] == "I":
+                parts[-1][1] = i + 1
 
         spans = []
-        for indices in parts:
-            if indices:
-                start = min(indices)
-                end = max(indices) + 1
-                label = tags[start].split("-", maxsplit=1)[1]
-                spans.append((start, end, label))
+        for start, end in parts:
+            label = tags[start].split("-", maxsplit=1)[1]
+            spans.append((start, end, label))
 
         return spans
 
@@ -573,8 +730,8 @@ def test_data(path: str):
         print()
 
 
-def convert_flat(path_in: str, path_out: str):
-    data = Data.load_from_flat_quintuplets(path_in)
+def convert_flat(path_in: str, path_out: str, trusted: bool = False):
+    data = Data.load_from_flat_quintuplets(path_in, trusted=trusted)
     data.analyze()
     data.save(path_out)
 
@@ -679,10 +679,12 @@ class Dataset:
         matrix = np.zeros((len(sorted_ids), size, size, size))
         mask = np.zeros((len(sorted_ids), size, size, size))
 
-        for index, lst in enumerate(entries):
-            for i, j, k, value in lst:
-                matrix[index, i, j, k] = value
-            num = lengths[index]
+        # Scatter the (i, j, k, value) entries of all samples in one assignment
+        arrays = [np.asarray(lst, dtype=np.int64).reshape(-1, 4) for lst in entries]
+        index = np.repeat(np.arange(len(arrays)), [len(a) for a in arrays])
+        i, j, k, value = np.concatenate(arrays).T
+        matrix[index, i, j, k] = value
+        for index, num in enumerate(lengths):
             mask[index, :num, :num, :num] = 1
 
         return {"quintuplet_matrix": matrix, "quintuplet_matrix_mask": mask > 0}
@@ -61,12 +61,12 @@ class PretrainedEncoder(nn.Module):
             )
         else:
             self.output_size = self.pretrained_model.config.hidden_size
-            self.mlp = lambda x: x
+            self.mlp = nn.Identity()
 
         if dropout > 0:
             self.dropout = nn.Dropout(p=dropout)
         else:
-            self.dropout = lambda x: x
+            self.dropout = nn.Identity()
 
         self.pad_id = self.pretrained_model.config.pad_token_id
         self.model_type = self.pretrained_model.config.model_type
@@ -159,12 +159,12 @@ class BertEncoder(nn.Module):
             )
         else:
             self.output_size = self.bert_model.config.hidden_size
-            self.mlp = lambda x: x
+            self.mlp = nn.Identity()
 
         if dropout > 0:
             self.dropout = nn.Dropout(p=dropout)
         else:
-            self.dropout = lambda x: x
+            self.dropout = nn.Identity()
 
     def get_output_dims(self):
         return self.output_size
@@ -225,10 +225,10 @@ class BertLayerNorm(nn.Module):
             tensor -- LayerNorm outputs
         """
 
-        u = x.mean(-1, keepdim=True)
-        s = (x - u).pow(2).mean(-1, keepdim=True)
-        x = (x - u) / torch.sqrt(s + self.variance_epsilon)
-        return self.weight * x + self.bias
+        # Fused kernel, same biased variance and epsilon as the unrolled formula
+        return nn.functional.layer_norm(
+            x, self.weight.shape, self.weight, self.bias, self.variance_epsilon
+        )
 
 
 class BertLinear(nn.Module):
@@ -258,7 +258,7 @@ class BertLinear(nn.Module):
         if dropout > 0:
             self.dropout = nn.Dropout(p=dropout)
         else:
-            self.dropout = lambda x: x
+            self.dropout = nn.Identity()
 
     def get_input_dims(self):
         return self.input_size
@@ -279,6 +279,25 @@ class BertLinear(nn.Module):
         output = self.activation(self.linear(x))
         return self.dropout(self.layer_norm(output))
 
+    def forward_pair(self, head, tail):
+        """This function propagates every concatenated pair [head_x; tail_y]
+        without materializing the concatenation, as the linear layer
+        splits into one projection per half
+
+        Arguments:
+            head {tensor} -- (batch, x, input_size / 2) tensor
+            tail {tensor} -- (batch, y, input_size / 2) tensor
+
+        Returns:
+            tensor -- (batch, x, y, output_size) Linear outputs
+        """
+
+        weight_head, weight_tail = self.linear.weight.chunk(2, dim=-1)
+        head = nn.functional.linear(head, weight_head, self.linear.bias)
+        tail = nn.functional.linear(tail, weight_tail)
+        output = self.activation(head.unsqueeze(dim=2) + tail.unsqueeze(dim=1))
+        return self.dropout(self.layer_norm(output))
+
 
 class BertEmbedModel(nn.Module):
     """This class acts as an embeddding layer with bert model"""
@@ -66,23 +66,19 @@ class EntRelJointDecoder(nn.Module):
         if cfg.logit_dropout > 0:
             self.logit_dropout = nn.Dropout(p=cfg.logit_dropout)
         else:
-            self.logit_dropout = lambda x: x
+            self.logit_dropout = nn.Identity()
 
         self.none_idx = self.vocab.get_token_index("None", "ent_rel_id")
 
-        self.symmetric_label = torch.LongTensor(ent_rel_file["symmetric"])
-        self.asymmetric_label = torch.LongTensor(ent_rel_file["asymmetric"])
-        self.ent_label = torch.LongTensor(ent_rel_file["entity"])
-        self.rel_label = torch.LongTensor(ent_rel_file["relation"])
-        if self.device > -1:
-            self.symmetric_label = self.symmetric_label.cuda(
-                device=self.device, non_blocking=True
-            )
-            self.asymmetric_label = self.asymmetric_label.cuda(
-                device=self.device, non_blocking=True
-            )
-            self.ent_label = self.ent_label.cuda(device=self.device, non_blocking=True)
-            self.rel_label = self.rel_label.cuda(device=self.device, non_blocking=True)
+        # Non-persistent buffers follow model.cuda() and stay out of checkpoints
+        for name, key in [
+            ("symmetric_label", "symmetric"),
+            ("asymmetric_label", "asymmetric"),
+            ("ent_label", "entity"),
+            ("rel_label", "relation"),
+        ]:
+            label = torch.as_tensor(ent_rel_file[key], dtype=torch.long)
+            self.register_buffer(name, label, persistent=False)
 
         self.element_loss = nn.CrossEntropyLoss()
 
@@ -120,12 +116,14 @@ class EntRelJointDecoder(nn.Module):
             dim=-1,
         )
 
-        batch_joint_score = torch.einsum(
-            "bxi, oij, byj -> boxy",
+        # Fixed contraction order as GEMMs, same as einsum "bxi, oij, byj -> bxyo"
+        num_labels, head_size, tail_size = self.U.shape
+        batch_size, seq_len, _ = batch_seq_tokens_tail_repr.shape
+        tail_u = batch_seq_tokens_tail_repr.matmul(self.U.reshape(-1, tail_size).t())
+        batch_joint_score = torch.bmm(
             batch_seq_tokens_head_repr,
-            self.U,
-            batch_seq_tokens_tail_repr,
-        ).permute(0, 2, 3, 1)
+            tail_u.reshape(batch_size, -1, head_size).transpose(1, 2),
+        ).reshape(batch_size, -1, seq_len, num_labels)
 
         batch_normalized_joint_score = (
             torch.softmax(batch_joint_score, dim=-1)
@@ -214,9 +212,9 @@ class EntRelJointDecoder(nn.Module):
         rel_preds = []
 
         batch_normalized_joint_score = batch_normalized_joint_score.cpu().numpy()
-        symmetric_label = self.symmetric_label.cpu().numpy()
-        ent_label = self.ent_label.cpu().numpy()
-        rel_label = self.rel_label.cpu().numpy()
+        symmetric_label = np.array(self.ent_rel_file["symmetric"], dtype=np.int64)
+        ent_label = np.array(self.ent_rel_file["entity"], dtype=np.int64)
+        rel_label = np.array(self.ent_rel_file["relation"], dtype=np.int64)
 
         for idx, seq_len in enumerate(batch_seq_tokens_lens):
             ent_pred = {}
@@ -227,61 +225,53 @@ class EntRelJointDecoder(nn.Module):
                 + joint_score[..., symmetric_label].transpose((1, 0, 2))
             ) / 2
 
-            joint_score_feature = joint_score.reshape(seq_len, -1)
-            transposed_joint_score_feature = joint_score.transpose((1, 0, 2)).reshape(
-                seq_len, -1
-            )
-            separate_pos = (
+            # Differences of adjacent rows and columns, without a transposed copy
+            row_diff = np.diff(joint_score, axis=0)
+            col_diff = np.diff(joint_score, axis=1)
+            # Row norms as dot-product reductions, cheaper than np.linalg.norm
+            separate_pos = np.flatnonzero(
                 (
-                    np.linalg.norm(
-                        joint_score_feature[0 : seq_len - 1]
-                        - joint_score_feature[1:seq_len],
-                        axis=1,
-                    )
-                    + np.linalg.norm(
-                        transposed_joint_score_feature[0 : seq_len - 1]
-                        - transposed_joint_score_feature[1:seq_len],
-                        axis=1,
-                    )
+                    np.sqrt(np.einsum("ijo,ijo->i", row_diff, row_diff))
+                    + np.sqrt(np.einsum("jio,jio->i", col_diff, col_diff))
                 )
                 * 0.5
                 > self.separate_threshold
-            ).nonzero()[0]
-            separate_position_preds.append([pos.item() for pos in separate_pos])
-            if len(separate_pos) > 0:
-                spans = [
-                    (0, separate_pos[0].item() + 1),
-                    (separate_pos[-1].item() + 1, seq_len),
-                ] + [
-                    (separate_pos[idx].item() + 1, separate_pos[idx + 1].item() + 1)
-                    for idx in range(len(separate_pos) - 1)
-                ]
-            else:
-                spans = [(0, seq_len)]
-
+            )
+            separate_position_preds.append(separate_pos.tolist())
+            bounds = [0] + (separate_pos + 1).tolist() + [seq_len]
+            spans = list(zip(bounds[:-1], bounds[1:]))
+            if len(spans) > 1:
+                # First and last spans come before the inner ones as before
+                spans = [spans[0], spans[-1]] + spans[1:-1]
+
+            # Integral image so that every span block mean is an O(1) lookup
+            cum = np.zeros((seq_len + 1, seq_len + 1, joint_score.shape[-1]))
+            cum[1:, 1:] = joint_score.cumsum(0, dtype=np.float64).cumsum(1)
+
+            starts, ends = np.array(spans).T
+            score = block_means(cum, starts, ends, starts, ends)
+            keep = score[:, ent_label].max(-1) >= score[:, self.none_idx]
+            preds = ent_label[score[:, ent_label].argmax(-1)]
             ents = []
-            for span in spans:
-                score = np.mean(
-                    joint_score[span[0] : span[1], span[0] : span[1], :], axis=(0, 1)
-                )
-                if not (np.max(score[ent_label]) < score[self.none_idx]):
-                    pred = ent_label[np.argmax(score[ent_label])].item()
+            for span, is_ent, pred in zip(spans, keep, preds.tolist()):
+                if is_ent:
                     pred_label = self.vocab.get_token_from_index(pred, "ent_rel_id")
                     ents.append(span)
                     ent_pred[span] = pred_label
 
-            for ent1 in ents:
-                for ent2 in ents:
-                    if ent1 == ent2:
-                        continue
-                    score = np.mean(
-                        joint_score[ent1[0] : ent1[1], ent2[0] : ent2[1], :],
-                        axis=(0, 1),
+            if ents:
+                starts, ends = np.array(ents).T
+                score = block_means(
+                    cum, starts[:, None], ends[:, None], starts[None], ends[None]
+                )
+                keep = score[..., rel_label].max(-1) >= score[..., self.none_idx]
+                np.fill_diagonal(keep, False)
+                preds = rel_label[score[..., rel_label].argmax(-1)]
+                for i, j in zip(*keep.nonzero()):
+                    pred_label = self.vocab.get_token_from_index(
+                        preds[i, j].item(), "ent_rel_id"
                     )
-                    if not (np.max(score[rel_label]) < score[self.none_idx]):
-                        pred = rel_label[np.argmax(score[rel_label])].item()
-                        pred_label = self.vocab.get_token_from_index(pred, "ent_rel_id")
-                        rel_pred[(ent1, ent2)] = pred_label
+                    rel_pred[(ents[i], ents[j])] = pred_label
 
             ent_preds.append(ent_pred)
             rel_preds.append(rel_pred)
@@ -289,15 +279,15 @@ class EntRelJointDecoder(nn.Module):
         return separate_position_preds, ent_preds, rel_preds
 
     def save(self, path: str):
-        device = self.device
+        # Copy tensors to cpu one by one instead of moving the whole model
+        state_dict = {k: v.detach().cpu() for k, v in self.state_dict().items()}
         info = dict(
-            state_dict=self.cpu().state_dict(),
+            state_dict=state_dict,
             cfg=self.cfg,
             vocab=self.vocab,
             ent_rel_file=self.ent_rel_file,
         )
         torch.save(info, path)
-        self.to(device)
         print(dict(save=path))
 
     @classmethod
@@ -313,6 +303,15 @@ class EntRelJointDecoder(nn.Module):
         return model
 
 
+def block_means(
+    cum: np.ndarray, x0: np.ndarray, x1: np.ndarray, y0: np.ndarray, y1: np.ndarray
+) -> np.ndarray:
+    # Mean of each score[x0:x1, y0:y1] block given the zero-padded integral image
+    # cum of score, broadcasting over the span index arrays
+    total = cum[x1, y1] - cum[x0, y1] - cum[x1, y0] + cum[x0, y0]
+    return total / ((x1 - x0) * (y1 - y0))[..., None]
+
+
 def decode_nonzero_spans(labels: List[int]) -> List[Tuple[int, int]]:
     i = -1
     spans = []
@@ -423,15 +422,15 @@ class Tagger(nn.Module):
         )
 
     def save(self, path: str):
-        device = self.device
+        # Copy tensors to cpu one by one instead of moving the whole model
+        state_dict = {k: v.detach().cpu() for k, v in self.state_dict().items()}
         info = dict(
-            state_dict=self.cpu().state_dict(),
+            state_dict=state_dict,
             cfg=self.cfg,
             vocab=self.vocab,
             ent_rel_file=self.ent_rel_file,
         )
         torch.save(info, path)
-        self.to(device)
         print(dict(save=path))
 
     @classmethod
@@ -476,9 +475,15 @@ def update_bounds(
 def decode_nonzero_cuboids(
     x: torch.Tensor,
 ) -> List[Tuple[int, int, int, int, int, int]]:
+    if x.is_sparse:
+        x = x.coalesce()  # Sorts indices lexicographically like nonzero()
+        nonzero = x.indices()[:, x.values() != 0].t()
+    else:
+        nonzero = x.nonzero()
+
     cuboids = []
-    for coordinates in x.nonzero():  # Assumes lexicographic sorting
-        i, j, k = map(int, coordinates)
+    # One transfer of the coordinates instead of a sync per element
+    for i, j, k in nonzero.tolist():  # Assumes lexicographic sorting
         for idx, bounds in enumerate(cuboids):
             if check_adjacent(i, j, k, bounds):
                 cuboids[idx] = update_bounds(i, j, k, bounds)
@@ -578,20 +583,27 @@ class CubeRE(nn.Module):
                 self.encoder_output_size,
             )
         )
-        self.U.data.zero_()
+        # Non-zero so that q_score is not uniform for the first training steps
+        nn.init.xavier_uniform_(self.U, gain=cfg.mlp_hidden_size ** -0.5)
 
         if cfg.logit_dropout > 0:
             self.logit_dropout = nn.Dropout(p=cfg.logit_dropout)
         else:
-            self.logit_dropout = lambda x: x
+            self.logit_dropout = nn.Identity()
 
         self.none_idx = self.vocab.get_token_index("None", "ent_rel_id")
-        self.ent_label = np.array(self.ent_rel_file["entity"])
-        self.rel_label = np.array(self.ent_rel_file["relation"])
-        self.q_label = np.array(self.ent_rel_file["qualifier"])
+        # Non-persistent buffers follow model.cuda() and stay out of checkpoints
+        for name, key in [
+            ("ent_label", "entity"),
+            ("rel_label", "relation"),
+            ("q_label", "qualifier"),
+        ]:
+            label = torch.as_tensor(self.ent_rel_file[key], dtype=torch.long)
+            self.register_buffer(name, label, persistent=False)
         self.element_loss = nn.CrossEntropyLoss()
         self.quintuplet_loss = nn.CrossEntropyLoss()
         self.prune_topk = self.get_config("prune_topk") or 0
+        self.amp = bool(self.get_config("amp"))
 
     def get_config(self, key: str):
         return getattr(self.cfg, key, None)
@@ -610,29 +622,22 @@ class CubeRE(nn.Module):
         batch_seq_tokens_encoder_repr = batch_inputs["seq_encoder_reprs"]
 
         batch_size, seq_len, hidden_size = batch_seq_tokens_encoder_repr.shape
-        head = batch_seq_tokens_encoder_repr.unsqueeze(dim=2).expand(
-            -1, -1, seq_len, -1
-        )
-        tail = batch_seq_tokens_encoder_repr.unsqueeze(dim=1).expand(
-            -1, seq_len, -1, -1
+        pair = self.pair_mlp.forward_pair(
+            batch_seq_tokens_encoder_repr, batch_seq_tokens_encoder_repr
         )
-        pair = torch.cat([head, tail], dim=-1)
-        pair = self.pair_mlp(pair)
         batch_joint_score = self.final_mlp(pair)
 
         if self.prune_topk > 0:
             topk = min(seq_len, self.prune_topk)
             seq_mask = batch_inputs["joint_label_matrix_mask"].diagonal(dim1=1, dim2=2)
             seq_score = batch_joint_score.diagonal(dim1=1, dim2=2).permute(0, 2, 1)
-            seq_score = seq_score[:, :, list(self.ent_label)].max(dim=-1).values
+            seq_score = seq_score[:, :, self.ent_label].max(dim=-1).values
             assert seq_mask.shape == seq_score.shape
             seq_score = torch.where(seq_mask, seq_score, seq_score.min())
             bs, _ = seq_score.shape
             indices = seq_score.topk(k=topk, dim=1).indices
             assert indices.shape == (bs, topk)
             pruned = batched_index_select(batch_seq_tokens_encoder_repr, indices)
-            head = pruned.unsqueeze(dim=2).expand(-1, -1, topk, -1)
-            tail = pruned.unsqueeze(dim=1).expand(-1, topk, -1, -1)
             batch_seq_tokens_encoder_repr = pruned
             for k in ["quintuplet_matrix_mask", "quintuplet_matrix"]:
                 batch_inputs[k] = prune_matrix(batch_inputs[k], indices)
@@ -640,29 +645,40 @@ class CubeRE(nn.Module):
             indices = None
 
         # Don't share representations with table/triplets
-        pair = self.pair2_mlp(torch.cat([head, tail], dim=-1))
+        pair = self.pair2_mlp.forward_pair(
+            batch_seq_tokens_encoder_repr, batch_seq_tokens_encoder_repr
+        )
 
         value = batch_seq_tokens_encoder_repr
-        q_score = torch.einsum("bxyi, oij, bzj -> bxyzo", pair, self.U, value)
+        # Apply U to value first: (batch, len, labels, hidden) is smaller than pair x U
+        # Both steps are plain GEMMs, equivalent to "bxyi, oij, bzj -> bxyzo"
+        num_labels, pair_size, value_size = self.U.shape
+        batch_size, x_len, y_len, _ = pair.shape
+        # Optionally keep the largest tensor in bfloat16, U stays in float32
+        with torch.cuda.amp.autocast(enabled=self.amp, dtype=torch.bfloat16):
+            value_u = value.matmul(self.U.reshape(-1, value_size).t())
+            q_score = torch.bmm(
+                pair.reshape(batch_size, x_len * y_len, pair_size),
+                value_u.reshape(batch_size, -1, pair_size).transpose(1, 2),
+            ).reshape(batch_size, x_len, y_len, -1, num_labels)
         mask = batch_inputs["quintuplet_matrix_mask"]
         assert q_score.shape[:-1] == mask.shape
 
         # Don't softmax before crossentropy and add logit dropout
         q_loss = self.quintuplet_loss(
-            self.logit_dropout(q_score[mask]),
+            self.logit_dropout(q_score[mask].float()),
             batch_inputs["quintuplet_matrix"][mask],
         )
 
         results = {}
         if not self.training:
-            batch_normalized_joint_score = (
-                torch.softmax(batch_joint_score, dim=-1)
-                * batch_inputs["joint_label_matrix_mask"].unsqueeze(-1).float()
-            )
-            batch_normalized_q_score = (
-                torch.softmax(q_score, dim=-1)
-                * batch_inputs["quintuplet_matrix_mask"].unsqueeze(-1).float()
-            )
+            # Zero padded positions in place instead of multiplying by a float mask
+            batch_normalized_joint_score = torch.softmax(
+                batch_joint_score, dim=-1
+            ).masked_fill_(~batch_inputs["joint_label_matrix_mask"].unsqueeze(-1), 0)
+            batch_normalized_q_score = torch.softmax(
+                q_score, dim=-1, dtype=torch.float
+            ).masked_fill_(~batch_inputs["quintuplet_matrix_mask"].unsqueeze(-1), 0)
 
             results["joint_label_preds"] = torch.argmax(
                 batch_normalized_joint_score, dim=-1
@@ -714,9 +730,10 @@ class CubeRE(nn.Module):
         rel_preds = []
         q_preds = []
 
-        ent_label = self.ent_label
-        rel_label = self.rel_label
-        q_label = self.q_label
+        # Gather with the device labels, map argmax ids back with host lists
+        ent_label = self.ent_rel_file["entity"]
+        rel_label = self.ent_rel_file["relation"]
+        q_label = self.ent_rel_file["qualifier"]
 
         for idx, seq_len in enumerate(batch_seq_tokens_lens):
             separate_position_preds.append([])
@@ -746,25 +763,36 @@ class CubeRE(nn.Module):
 
             joint_score = batch_normalized_joint_score[idx][:seq_len, :seq_len, :]
             cuboids = decode_nonzero_cuboids(q_score.argmax(-1))
-            for i_start, i_end, j_start, j_end, k_start, k_end in cuboids:
-                score = q_score[
-                    i_start:i_end,
-                    j_start:j_end,
-                    k_start:k_end,
-                ].mean((0, 1, 2))
-                pred = q_label[score.cpu().numpy()[q_label].argmax()].item()
-                pred_label = self.vocab.get_token_from_index(pred, "ent_rel_id")
-                spans = ((i_start, i_end), (j_start, j_end), (k_start, k_end))
-                q_pred[spans] = pred_label
-
-                score = joint_score[i_start:i_end, j_start:j_end].mean((0, 1))
-                pred = rel_label[score.cpu().numpy()[rel_label].argmax()].item()
-                pred_label = self.vocab.get_token_from_index(pred, "ent_rel_id")
-                rel_pred[spans[:2]] = pred_label
+            # Score every cuboid on the device, then transfer only the argmax ids
+            q_ids, rel_ids = [], []
+            if cuboids:
+                q_scores = torch.stack(
+                    [
+                        q_score[i0:i1, j0:j1, k0:k1].mean((0, 1, 2))
+                        for i0, i1, j0, j1, k0, k1 in cuboids
+                    ]
+                )
+                rel_scores = torch.stack(
+                    [
+                        joint_score[i0:i1, j0:j1].mean((0, 1))
+                        for i0, i1, j0, j1, _, _ in cuboids
+                    ]
+                )
+                q_ids = q_scores[:, self.q_label].argmax(-1).tolist()
+                rel_ids = rel_scores[:, self.rel_label].argmax(-1).tolist()
 
+            ent_pred_label = self.vocab.get_token_from_index(ent_label[0], "ent_rel_id")
+            for cuboid, q_id, rel_id in zip(cuboids, q_ids, rel_ids):
+                i_start, i_end, j_start, j_end, k_start, k_end = cuboid
+                spans = ((i_start, i_end), (j_start, j_end), (k_start, k_end))
+                pred = q_label[q_id]
+                q_pred[spans] = self.vocab.get_token_from_index(pred, "ent_rel_id")
+                pred = rel_label[rel_id]
+                rel_pred[spans[:2]] = self.vocab.get_token_from_index(
+                    pred, "ent_rel_id"
+                )
                 for sp in spans:
-                    pred = ent_label[0].item()
-                    ent_pred[sp] = self.vocab.get_token_from_index(pred, "ent_rel_id")
+                    ent_pred[sp] = ent_pred_label
 
             ent_preds.append(ent_pred)
             rel_preds.append(rel_pred)
@@ -778,15 +806,15 @@ class CubeRE(nn.Module):
         )
 
     def save(self, path: str):
-        device = self.device
+        # Copy tensors to cpu one by one instead of moving the whole model
+        state_dict = {k: v.detach().cpu() for k, v in self.state_dict().items()}
         info = dict(
-            state_dict=self.cpu().state_dict(),
+            state_dict=state_dict,
             cfg=self.cfg,
             vocab=self.vocab,
             ent_rel_file=self.ent_rel_file,
         )
         torch.save(info, path)
-        self.to(device)
         print(dict(save=path))
 
     @classmethod
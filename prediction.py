@@ -1,14 +1,23 @@
 import json
 import os
+from collections import defaultdict
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
 
 import torch
 from fire import Fire
 from tqdm import tqdm
 from transformers import AutoTokenizer
 
-from data_process import Sentence, process, Data, RawPred, add_tokens, add_joint_label
+from data_process import (
+    Sentence,
+    process,
+    Data,
+    RawPred,
+    Relation,
+    add_tokens,
+    add_joint_label,
+)
 from data_reader import Dataset, DataReader, Instance
 from scoring import EntityScorer, QuintupletScorer, StrictScorer
 from training import run_eval, score_preds, load_model, prepare_inputs, process_outputs
@@ -23,28 +32,33 @@ def merge_pipeline_preds(
     sep: str = " | ",  # Refer to convert_sent_to_tags
 ) -> List[Sentence]:
     with open(path_triplets) as f:
-        sents = [Sentence(**json.loads(line)) for line in f]
+        sents = [Sentence.parse_raw(line) for line in f]
     with open(path_tags) as f:
-        s_tags = [Sentence(**json.loads(line)) for line in f]
+        s_tags = [Sentence.parse_raw(line) for line in f]
     text_to_i = {s.text: i for i, s in enumerate(sents)}
     assert all(sep not in text for text in text_to_i.keys())
+    # Relations of each sentence keyed by (head, tail, label) text, built lazily
+    index: Dict[int, Dict[Tuple[str, str, str], List[Relation]]] = {}
 
     for s in s_tags:
         text, head, relation, tail = s.text.split(sep)
         if text in text_to_i.keys():
             i = text_to_i[text]
-            relations = sents[i].relations
             spans = set(e.span for e in sents[i].entities)
-
-            for r in relations:
-                r_head = " ".join(s.tokens[slice(*r.head)])
-                r_tail = " ".join(s.tokens[slice(*r.tail)])
-                if (r_head, r_tail, r.label) == (head, tail, relation):
-                    for e in s.entities:
-                        r.qualifiers.append(e)
-                        if e.span not in spans:
-                            spans.add(e.span)
-                            sents[i].entities.append(e)
+            if i not in index:
+                # Tag sentences of the same text share the same leading tokens
+                index[i] = defaultdict(list)
+                for r in sents[i].relations:
+                    r_head = " ".join(s.tokens[slice(*r.head)])
+                    r_tail = " ".join(s.tokens[slice(*r.tail)])
+                    index[i][(r_head, r_tail, r.label)].append(r)
+
+            for r in index[i].get((head, tail, relation), []):
+                for e in s.entities:
+                    r.qualifiers.append(e)
+                    if e.span not in spans:
+                        spans.add(e.span)
+                        sents[i].entities.append(e)
         else:
             print(dict(unmatched=text))
 
@@ -81,7 +95,7 @@ def eval_pipeline(
     Data(sents=preds).save(temp_tags)
 
     with open(Path(dir_data) / f"{data_split}.json") as f:
-        sents = [Sentence(**json.loads(line)) for line in f]
+        sents = [Sentence.parse_raw(line) for line in f]
 
     results = {}
     for scorer in [EntityScorer(), StrictScorer(), QuintupletScorer()]:
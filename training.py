@@ -8,6 +8,7 @@ from pathlib import Path
 from typing import Dict, List
 
 import numpy as np
+import orjson
 import torch
 import torch.nn as nn
 from torch import Tensor
@@ -212,17 +213,28 @@ def process_outputs(
     batch_inputs: Dict[str, Tensor], batch_outputs: Dict[str, Tensor]
 ) -> List[dict]:
     all_outputs = []
+    keys = set(batch_inputs.keys()).union(batch_outputs.keys())
+    # One transfer per tensor for the whole batch instead of one per sample
+    arrays = {}
+    for k in keys.intersection(
+        ["quintuplet_preds", "tokens", "joint_label_matrix", "joint_label_preds"]
+    ):
+        v = batch_inputs.get(k)
+        if v is None:
+            v = batch_outputs[k]
+        arrays[k] = v.cpu().numpy()
+
     for i in range(len(batch_inputs["tokens_lens"])):
         output = dict()
-        for k in set(batch_inputs.keys()).union(batch_outputs.keys()):
+        for k in keys:
             v = batch_inputs.get(k)
             if v is None:
                 v = batch_outputs[k]
 
             if k in ["quintuplet_preds"]:
-                output[k] = SparseCube.from_numpy(v[i].cpu().numpy()).dict()
+                output[k] = SparseCube.from_numpy(arrays[k][i]).dict()
             if k in ["tokens", "joint_label_matrix", "joint_label_preds"]:
-                output[k] = v[i].cpu().numpy()
+                output[k] = arrays[k][i]
             if k in [
                 "seq_len",
                 "all_separate_position_preds",
@@ -280,11 +292,11 @@ def evaluate(
     # Save processed sents
     path = Path(cfg.save_dir) / f"{data_split}.json"
     print(dict(path=path))
-    with open(path, "w") as f:
+    with open(path, "wb", buffering=1 << 20) as f:
         for r in all_outputs:
             # noinspection Pydantic
             sent = RawPred(**r).as_sentence(model.vocab)
-            f.write(sent.json() + "\n")
+            f.write(orjson.dumps(sent.dict(), option=orjson.OPT_APPEND_NEWLINE))
 
     mapping = dict(train=cfg.train_file, dev=cfg.dev_file, test=cfg.test_file)
     results = score_preds(path_pred=str(path), path_gold=path_in or mapping[data_split])